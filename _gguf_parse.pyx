@@ -0,0 +1,141 @@
+# cython: language_level=3, boundscheck=False, wraparound=False
+"""
+Compiled header scanner for split_gguf_proper.py
+
+Walks the metadata and tensor-info sections of a GGUF header straight out of
+a buffer (the read-only mmap of the input) without per-field interpreter
+dispatch. split_gguf_proper.py falls back to its pure-Python parser when this
+module has not been built.
+
+Build: cythonize -i _gguf_parse.pyx
+"""
+
+from libc.stdint cimport uint32_t, uint64_t
+from libc.string cimport memcpy
+
+# Same limits as the pure-Python parser
+cdef enum:
+    MAX_STRING_LENGTH = 1024 * 1024
+    MAX_ARRAY_LENGTH = 1000000
+
+cdef inline uint32_t read_u32(const unsigned char* p) nogil:
+    cdef uint32_t v
+    memcpy(&v, p, 4)
+    return v
+
+cdef inline uint64_t read_u64(const unsigned char* p) nogil:
+    cdef uint64_t v
+    memcpy(&v, p, 8)
+    return v
+
+cdef inline Py_ssize_t need(Py_ssize_t pos, Py_ssize_t count, Py_ssize_t length) except -1:
+    """Return pos + count, raising if that runs past the end of the buffer"""
+    if count < 0 or pos + count > length:
+        raise ValueError(f"Unexpected end of file at position {pos}")
+    return pos + count
+
+cdef inline Py_ssize_t skip_string(const unsigned char* buf, Py_ssize_t pos, Py_ssize_t length) except -1:
+    cdef uint64_t n
+    need(pos, 8, length)
+    n = read_u64(buf + pos)
+    if n > MAX_STRING_LENGTH:
+        raise ValueError(f"String length too large: {n} bytes (at position {pos})")
+    return need(pos + 8, <Py_ssize_t>n, length)
+
+cdef Py_ssize_t skip_value(const unsigned char* buf, Py_ssize_t pos, Py_ssize_t length,
+                           uint32_t value_type, bint check_array_len) except -2:
+    """Advance past one metadata value, returns -1 for an unknown value type"""
+    cdef uint32_t array_type
+    cdef uint64_t array_len, j
+    if value_type == 8:  # STRING
+        return skip_string(buf, pos, length)
+    if value_type == 0 or value_type == 1 or value_type == 7:  # UINT8, INT8, BOOL
+        return need(pos, 1, length)
+    if value_type == 2 or value_type == 3:  # UINT16, INT16
+        return need(pos, 2, length)
+    if value_type == 4 or value_type == 5 or value_type == 6:  # UINT32, INT32, FLOAT32
+        return need(pos, 4, length)
+    if value_type == 9:  # ARRAY
+        need(pos, 12, length)
+        array_type = read_u32(buf + pos)
+        array_len = read_u64(buf + pos + 4)
+        pos += 12
+        if check_array_len and array_len > MAX_ARRAY_LENGTH:
+            raise ValueError(f"Array length too large: {array_len}")
+        if array_type == 8:
+            for j in range(array_len):
+                pos = skip_string(buf, pos, length)
+            return pos
+        # Every other element type is treated as 4 bytes wide, as in read_array
+        if array_len > <uint64_t>(length - pos) // 4:
+            raise ValueError(f"Unexpected end of file at position {pos}")
+        return pos + <Py_ssize_t>(4 * array_len)
+    return -1
+
+def scan_header(const unsigned char[::1] data, Py_ssize_t pos,
+                uint64_t general_metadata_count, uint64_t tensor_metadata_count):
+    """
+    Scan the header of data starting at pos, just past the two metadata counts
+
+    Returns (found_metadata, tensor_infos, end) where found_metadata counts the
+    general entries with a known value type, tensor_infos is a list of
+    (name, dims, type, offset) tuples and end is the position after the last
+    tensor info record.
+    """
+    cdef const unsigned char* buf = &data[0]
+    cdef Py_ssize_t length = data.shape[0]
+    cdef Py_ssize_t next_pos, name_start
+    cdef uint64_t i, num_tensors, name_len
+    cdef uint32_t value_type, n_dims, d
+    cdef Py_ssize_t found = 0
+    cdef list tensor_infos
+    cdef list dims
+
+    # General metadata: values are only counted, the splitter never uses them
+    for i in range(general_metadata_count):
+        pos = skip_string(buf, pos, length)  # key
+        need(pos, 4, length)
+        value_type = read_u32(buf + pos)
+        pos += 4
+        next_pos = skip_value(buf, pos, length, value_type, True)
+        if next_pos < 0:
+            # Unknown type: skip 4 bytes as a guess, like the Python parser
+            pos = min(pos + 4, length)
+            continue
+        pos = next_pos
+        found += 1
+
+    # Tensor metadata is skipped outright
+    for i in range(tensor_metadata_count):
+        pos = skip_string(buf, pos, length)  # key
+        need(pos, 4, length)
+        value_type = read_u32(buf + pos)
+        pos += 4
+        next_pos = skip_value(buf, pos, length, value_type, False)
+        if next_pos >= 0:
+            pos = next_pos
+
+    need(pos, 8, length)
+    num_tensors = read_u64(buf + pos)
+    pos += 8
+
+    tensor_infos = []
+    for i in range(num_tensors):
+        need(pos, 8, length)
+        name_len = read_u64(buf + pos)
+        if name_len > MAX_STRING_LENGTH:
+            raise ValueError(f"String length too large: {name_len} bytes (at position {pos})")
+        name_start = pos + 8
+        pos = need(name_start, <Py_ssize_t>name_len, length)
+        name = (<const char*>buf)[name_start:pos].decode('utf-8')
+
+        need(pos, 4, length)
+        n_dims = read_u32(buf + pos)
+        pos += 4
+        need(pos, 8 * <Py_ssize_t>n_dims + 12, length)
+        dims = [read_u64(buf + pos + 8 * d) for d in range(n_dims)]
+        pos += 8 * n_dims
+        tensor_infos.append((name, dims, read_u32(buf + pos), read_u64(buf + pos + 4)))
+        pos += 12
+
+    return found, tensor_infos, pos
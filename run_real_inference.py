@@ -3,49 +3,153 @@
 
 import sys
 import os
+import hashlib
+import pickle
 
 try:
-    from llama_cpp import Llama
-    
     model_path = "models_cache/mistral-7b-instruct-v0.2.Q4_K_M.gguf"
     
     if not os.path.exists(model_path):
         print(f"Error: Model file not found at {model_path}", file=sys.stderr)
         sys.exit(1)
     
+    # Start kernel readahead of the weights while llama_cpp is still importing
+    if hasattr(os, 'posix_fadvise'):
+        fd = os.open(model_path, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        finally:
+            os.close(fd)
+    
+    from llama_cpp import Llama, StoppingCriteriaList
+    
     print(f"Loading model: {model_path}", file=sys.stderr)
     print("This may take a moment...", file=sys.stderr)
     
-    # Initialize Llama
+    # Lock the weights in RAM only when they fit with room to spare
+    use_mlock = False
+    if hasattr(os, 'sysconf'):
+        try:
+            total_ram = os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+            use_mlock = os.path.getsize(model_path) * 2 < total_ram
+        except (ValueError, OSError):
+            pass
+    
+    # Initialize Llama. Weights are demand-paged from the mmapped file
+    # instead of being read into memory up front.
+    n_threads = os.cpu_count() or 8
+    n_ctx = 2048
     llm = Llama(
         model_path=model_path,
-        n_ctx=2048,      # Context window
-        n_threads=8,    # Number of CPU threads
-        verbose=False   # Suppress verbose output
+        n_ctx=n_ctx,                # Context window
+        n_threads=n_threads,        # CPU threads for generation
+        n_threads_batch=n_threads,  # CPU threads for prompt processing
+        n_batch=512,                # Prompt tokens per batch
+        use_mmap=True,              # Map the model file instead of reading it
+        use_mlock=use_mlock,        # Keep mapped weights resident
+        verbose=False               # Suppress verbose output
     )
     
-    print("Model loaded. Generating response...", file=sys.stderr)
-    print("", file=sys.stderr)
+    print("Model loaded.", file=sys.stderr)
     
-    # Generate response
     prompt = "Describe a cat."
     
-    response = llm(
+    # Reuse the prompt's KV cache from an earlier run instead of recomputing
+    # the prefill. The cache is keyed by prompt and context size and is
+    # ignored once the model file is newer than it.
+    #
+    # The cache is a pickle, and unpickling runs code, so it is only as
+    # trustworthy as the models_cache directory: anyone who can write there
+    # can run code in this process. As a guard, a cache file is only loaded
+    # when it is owned by the current user and not writable by others.
+    cache_key = hashlib.sha256(f"{n_ctx}:{prompt}".encode('utf-8')).hexdigest()[:16]
+    kv_cache_path = f"{model_path}.kv-{cache_key}.bin"
+    
+    def kv_cache_trusted(path):
+        if not hasattr(os, 'getuid'):
+            return True
+        st = os.stat(path)
+        return st.st_uid == os.getuid() and not st.st_mode & 0o022
+    
+    state_restored = False
+    if os.path.exists(kv_cache_path) and os.path.getmtime(kv_cache_path) >= os.path.getmtime(model_path):
+        if not kv_cache_trusted(kv_cache_path):
+            print(f"Warning: ignoring KV cache {kv_cache_path}: not owned by this user or writable by others", file=sys.stderr)
+        else:
+            try:
+                with open(kv_cache_path, 'rb') as kv_f:
+                    llm.load_state(pickle.load(kv_f))
+                state_restored = True
+                print(f"Restored prompt KV cache: {kv_cache_path}", file=sys.stderr)
+            except Exception as e:
+                print(f"Warning: ignoring unreadable KV cache {kv_cache_path}: {e}", file=sys.stderr)
+                llm.reset()
+    
+    if not state_restored:
+        # Prefill the prompt once and save the resulting state for next time
+        llm.eval(llm.tokenize(prompt.encode('utf-8')))
+        tmp_path = kv_cache_path + ".tmp"
+        try:
+            # Private mode so the file passes kv_cache_trusted on the next run
+            with open(tmp_path, 'wb', opener=lambda path, flags: os.open(path, flags, 0o600)) as kv_f:
+                pickle.dump(llm.save_state(), kv_f)
+            os.replace(tmp_path, kv_cache_path)
+            print(f"Saved prompt KV cache: {kv_cache_path}", file=sys.stderr)
+        except OSError as e:
+            # The cache is optional, e.g. models_cache may be read-only or full
+            print(f"Warning: could not write KV cache {kv_cache_path}: {e}", file=sys.stderr)
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+    
+    print("Generating response...", file=sys.stderr)
+    print("", file=sys.stderr)
+    
+    # Stop on a triple newline by comparing token ids rather than matching
+    # the decoded text after every token
+    newline_id = llm.tokenize(b"\n", add_bos=False)[-1]
+    
+    def stop_on_triple_newline(input_ids, logits):
+        return len(input_ids) >= 3 and all(t == newline_id for t in input_ids[-3:])
+    
+    print("=" * 70)
+    print("REAL AI RESPONSE:")
+    print("=" * 70)
+    
+    # Stream the response so text appears as soon as the first token is
+    # decoded. The prompt tokens match the restored state, so llama.cpp only
+    # evaluates what is not already in the KV cache.
+    started = False
+    # Trailing whitespace is held back until more text follows, so the output
+    # ends like the old stop=["\n\n\n"] plus .strip() did. The stopping
+    # criterion only fires after the third newline has been evaluated, so the
+    # loop also cuts the text at the triple newline itself.
+    pending = ""
+    for chunk in llm(
         prompt=prompt,
         max_tokens=256,
         temperature=0.7,
         top_p=0.9,
         echo=False,  # Don't echo the prompt
-        stop=["\n\n\n"]  # Stop on triple newline
-    )
-    
-    # Extract and print the generated text
-    generated_text = response['choices'][0]['text'].strip()
+        stream=True,
+        stopping_criteria=StoppingCriteriaList([stop_on_triple_newline])
+    ):
+        text = chunk['choices'][0]['text']
+        if not started:
+            # Drop leading whitespace, as the non-streaming output did
+            text = text.lstrip()
+            started = bool(text)
+        pending += text
+        if "\n\n\n" in pending:
+            sys.stdout.write(pending[:pending.index("\n\n\n")].rstrip())
+            break
+        body = pending.rstrip()
+        sys.stdout.write(body)
+        sys.stdout.flush()
+        pending = pending[len(body):]
     
-    print("=" * 70)
-    print("REAL AI RESPONSE:")
-    print("=" * 70)
-    print(generated_text)
+    print()
     print("=" * 70)
     
 except ImportError:
@@ -6,21 +6,102 @@ Splits a GGUF file into N shards for distributed inference
 Usage: python split_gguf_proper.py <input.gguf> <num_shards> [output_dir]
 """
 
+import errno
+import mmap
 import struct
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from bisect import bisect_left
+from itertools import accumulate
+from math import prod
 import sys
 import os
 from pathlib import Path
 
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Optional compiled header scanner (cythonize -i _gguf_parse.pyx)
+try:
+    import _gguf_parse
+except ImportError:
+    _gguf_parse = None
+
 # GGUF file format constants
 GGUF_MAGIC = b'GGUF'
 GGUF_VERSION = 3
 
+# Read buffer for the header scan; amortizes thousands of tiny field reads
+HEADER_READ_BUFFER_SIZE = 4 * 1024 * 1024
+
+# Bump when the layout of the tensor index sidecar changes
+TENSOR_INDEX_FORMAT = 2
+
+# Largest single copy request for tensor data; bounds peak memory on the
+# mapping fallback path and keeps each kernel copy call short
+COPY_CHUNK_SIZE = 8 * 1024 * 1024
+
+# Shards at least this large are written with O_DIRECT so the write-once
+# output does not evict input pages still waiting to be copied
+DIRECT_IO_MIN_SHARD_SIZE = 64 * 1024 * 1024
+DIRECT_IO_ALIGNMENT = 4096
+# Page-aligned bounce buffer that O_DIRECT writes are staged through
+DIRECT_IO_BUFFER_SIZE = 2 * 1024 * 1024
+
+# Precompiled little-endian scalar codecs used by the header parser
+_U8 = struct.Struct('<B')
+_I8 = struct.Struct('<b')
+_U16 = struct.Struct('<H')
+_I16 = struct.Struct('<h')
+_U32 = struct.Struct('<I')
+_I32 = struct.Struct('<i')
+_F32 = struct.Struct('<f')
+_U64 = struct.Struct('<Q')
+_BOOL = struct.Struct('<?')
+
+# Encoded size in bytes of each scalar metadata value type
+_VALUE_TYPE_SIZES = {0: 1, 1: 1, 7: 1, 2: 2, 3: 2, 4: 4, 5: 4, 6: 4}
+
+# Tensor type -> (elements per block, bytes per block), as in ggml's type traits.
+# Quantized types are stored in fixed-size blocks, e.g. Q4_0 packs 32 weights
+# into 18 bytes (one f16 scale + 16 bytes of nibbles).
+_TYPE_SIZES = {
+    0: (1, 4),       # F32
+    1: (1, 2),       # F16
+    2: (32, 18),     # Q4_0
+    3: (32, 20),     # Q4_1
+    6: (32, 22),     # Q5_0
+    7: (32, 24),     # Q5_1
+    8: (32, 34),     # Q8_0
+    9: (32, 36),     # Q8_1
+    10: (256, 84),   # Q2_K
+    11: (256, 110),  # Q3_K
+    12: (256, 144),  # Q4_K
+    13: (256, 176),  # Q5_K
+    14: (256, 210),  # Q6_K
+    15: (256, 292),  # Q8_K
+    24: (1, 1),      # I8
+    25: (1, 2),      # I16
+    26: (1, 4),      # I32
+    27: (1, 8),      # I64
+    28: (1, 8),      # F64
+    30: (1, 2),      # BF16
+}
+# Unknown types are assumed to be 4 bytes per element
+_DEFAULT_TYPE_SIZE = (1, 4)
+
+# struct codes for the 4-byte array element types (UINT32, INT32, FLOAT32)
+_ARRAY_ELEMENT_FORMATS = {4: 'I', 5: 'i', 6: 'f'}
+
 def read_string(f):
     """Read a length-prefixed string from GGUF file"""
     length_bytes = f.read(8)
     if len(length_bytes) < 8:
         raise ValueError("Unexpected end of file while reading string length")
-    length = struct.unpack('<Q', length_bytes)[0]
+    length = _U64.unpack(length_bytes)[0]
     # Safety check: prevent reading unreasonably large strings
     if length > 1024 * 1024:  # 1MB max string length
         raise ValueError(f"String length too large: {length} bytes (at position {f.tell() - 8})")
@@ -29,12 +110,66 @@ def read_string(f):
         raise ValueError(f"Unexpected end of file: expected {length} bytes, got {len(data)}")
     return data.decode('utf-8')
 
+def skip_string(f):
+    """Advance past a length-prefixed string without reading or decoding it, returns its length"""
+    length_bytes = f.read(8)
+    if len(length_bytes) < 8:
+        raise ValueError("Unexpected end of file while reading string length")
+    length = _U64.unpack(length_bytes)[0]
+    if length > 1024 * 1024:  # 1MB max string length
+        raise ValueError(f"String length too large: {length} bytes (at position {f.tell() - 8})")
+    f.seek(length, 1)
+    return length
+
+def read_array(f, array_type, array_len):
+    """Read the payload of a metadata ARRAY value"""
+    if array_type == 8:  # STRING
+        return [read_string(f) for _ in range(array_len)]
+    
+    payload = f.read(4 * array_len)
+    fmt = _ARRAY_ELEMENT_FORMATS.get(array_type)
+    if fmt is None:
+        # Skip unknown array types
+        return []
+    # Decode the whole payload in one C-level call
+    return list(struct.unpack(f'<{array_len}{fmt}', payload))
+
+def skip_array(f, array_type, array_len):
+    """Advance past the payload of a metadata ARRAY value without decoding it"""
+    if array_type == 8:  # STRING
+        for _ in range(array_len):
+            skip_string(f)
+    else:
+        f.seek(4 * array_len, 1)
+
+class LazyValue:
+    """A STRING or ARRAY metadata value left in the file until it is needed"""
+    __slots__ = ('f', 'off', 'len', 'kind', 'array_type')
+    
+    def __init__(self, f, off, length, kind, array_type=None):
+        self.f = f
+        self.off = off        # Start of the string bytes or array payload
+        self.len = length     # Byte length of a string, element count of an array
+        self.kind = kind      # Metadata value type (8 = STRING, 9 = ARRAY)
+        self.array_type = array_type
+    
+    def materialize(self):
+        """Decode the value, leaving the file position where it was"""
+        pos = self.f.tell()
+        try:
+            self.f.seek(self.off)
+            if self.kind == 8:
+                return self.f.read(self.len).decode('utf-8')
+            return read_array(self.f, self.array_type, self.len)
+        finally:
+            self.f.seek(pos)
+
 def read_metadata(f):
-    """Read GGUF metadata section"""
+    """Read GGUF metadata section; STRING and ARRAY values are returned as LazyValue"""
     metadata = {}
     
     # Read number of key-value pairs
-    num_kv = struct.unpack('<Q', f.read(8))[0]
+    num_kv = _U64.unpack(f.read(8))[0]
     
     # Safety check: prevent reading unreasonably large metadata
     if num_kv > 10000:  # Sanity check
@@ -42,45 +177,35 @@ def read_metadata(f):
     
     for _ in range(num_kv):
         key = read_string(f)
-        value_type = struct.unpack('<I', f.read(4))[0]
+        value_type = _U32.unpack(f.read(4))[0]
         
         if value_type == 8:  # STRING
-            value = read_string(f)
+            length = skip_string(f)
+            value = LazyValue(f, f.tell() - length, length, value_type)
         elif value_type == 0:  # UINT8
-            value = struct.unpack('<B', f.read(1))[0]
+            value = _U8.unpack(f.read(1))[0]
         elif value_type == 1:  # INT8
-            value = struct.unpack('<b', f.read(1))[0]
+            value = _I8.unpack(f.read(1))[0]
         elif value_type == 2:  # UINT16
-            value = struct.unpack('<H', f.read(2))[0]
+            value = _U16.unpack(f.read(2))[0]
         elif value_type == 3:  # INT16
-            value = struct.unpack('<h', f.read(2))[0]
+            value = _I16.unpack(f.read(2))[0]
         elif value_type == 4:  # UINT32
-            value = struct.unpack('<I', f.read(4))[0]
+            value = _U32.unpack(f.read(4))[0]
         elif value_type == 5:  # INT32
-            value = struct.unpack('<i', f.read(4))[0]
+            value = _I32.unpack(f.read(4))[0]
         elif value_type == 6:  # FLOAT32
-            value = struct.unpack('<f', f.read(4))[0]
+            value = _F32.unpack(f.read(4))[0]
         elif value_type == 7:  # BOOL
-            value = struct.unpack('<?', f.read(1))[0]
+            value = _BOOL.unpack(f.read(1))[0]
         elif value_type == 9:  # ARRAY
-            array_type = struct.unpack('<I', f.read(4))[0]
-            array_len = struct.unpack('<Q', f.read(8))[0]
+            array_type = _U32.unpack(f.read(4))[0]
+            array_len = _U64.unpack(f.read(8))[0]
             # Safety check for array length
             if array_len > 1000000:  # 1M max array elements
                 raise ValueError(f"Array length too large: {array_len}")
-            value = []
-            for _ in range(array_len):
-                if array_type == 8:  # STRING
-                    value.append(read_string(f))
-                elif array_type == 4:  # UINT32
-                    value.append(struct.unpack('<I', f.read(4))[0])
-                elif array_type == 5:  # INT32
-                    value.append(struct.unpack('<i', f.read(4))[0])
-                elif array_type == 6:  # FLOAT32
-                    value.append(struct.unpack('<f', f.read(4))[0])
-                else:
-                    # Skip unknown array types
-                    f.read(4 * array_len)
+            value = LazyValue(f, f.tell(), array_len, value_type, array_type)
+            skip_array(f, array_type, array_len)
         else:
             # Skip unknown types
             continue
@@ -90,74 +215,290 @@ def read_metadata(f):
     return metadata
 
 def read_tensor_info(f):
-    """Read tensor information"""
+    """Read tensor information as a (name, dims, type, offset) tuple"""
     name = read_string(f)
-    n_dims = struct.unpack('<I', f.read(4))[0]
-    dims = [struct.unpack('<Q', f.read(8))[0] for _ in range(n_dims)]
-    tensor_type = struct.unpack('<I', f.read(4))[0]
-    offset = struct.unpack('<Q', f.read(8))[0]
+    n_dims = _U32.unpack(f.read(4))[0]
+    dims = [_U64.unpack(f.read(8))[0] for _ in range(n_dims)]
+    tensor_type = _U32.unpack(f.read(4))[0]
+    offset = _U64.unpack(f.read(8))[0]
     
+    return name, dims, tensor_type, offset
+
+def new_tensor_table(num_tensors):
+    """Allocate a column-wise (struct-of-arrays) table for num_tensors tensors"""
+    # Numeric columns are packed C arrays rather than one dict per tensor
     return {
-        'name': name,
-        'dims': dims,
-        'type': tensor_type,
-        'offset': offset
+        'names': [None] * num_tensors,
+        'dims': [None] * num_tensors,
+        'types': array('I', bytes(4 * num_tensors)),
+        'offsets': array('Q', bytes(8 * num_tensors)),
+        'sizes': array('Q', bytes(8 * num_tensors)),
     }
 
 def get_tensor_size(dims, tensor_type):
     """Calculate tensor size in bytes"""
-    # Tensor type sizes (simplified - actual GGUF has more types)
-    type_sizes = {
-        0: 1,   # F32
-        1: 2,   # F16
-        2: 4,   # Q4_0
-        3: 4,   # Q4_1
-        6: 4,   # Q5_0
-        7: 4,   # Q5_1
-        8: 4,   # Q8_0
-        9: 1,   # Q8_1
-        10: 1,  # Q2_K
-        11: 1,  # Q3_K
-        12: 1,  # Q4_K
-        13: 1,  # Q5_K
-        14: 1,  # Q6_K
-    }
+    block_size, block_bytes = _TYPE_SIZES.get(tensor_type, _DEFAULT_TYPE_SIZE)
+    return prod(dims) // block_size * block_bytes
+
+def fill_tensor_sizes(tensors):
+    """Fill the sizes column by calling get_tensor_size on each tensor's dims and type"""
+    tensors['sizes'][:] = array('Q', map(get_tensor_size, tensors['dims'], tensors['types']))
+
+def advise_sequential(f, mm):
+    """Hint the kernel that the input file will be read front to back"""
+    if hasattr(os, 'posix_fadvise'):
+        os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+    # mmap.madvise is not available on Windows
+    if hasattr(mm, 'madvise') and hasattr(mmap, 'MADV_SEQUENTIAL'):
+        mm.madvise(mmap.MADV_SEQUENTIAL)
+
+def _kernel_copy(src_fd, dst_fd, offset, size):
+    """Copy bytes between file descriptors inside the kernel, returns bytes copied"""
+    use_copy_file_range = hasattr(os, 'copy_file_range')
+    copied = 0
+    while copied < size:
+        count = min(COPY_CHUNK_SIZE, size - copied)
+        try:
+            if use_copy_file_range:
+                n = os.copy_file_range(src_fd, dst_fd, count, offset + copied)
+            else:
+                n = os.sendfile(dst_fd, src_fd, offset + copied, count)
+        except OSError:
+            # Filesystem or platform refused (e.g. EXDEV, ENOSYS, EINVAL)
+            if use_copy_file_range and hasattr(os, 'sendfile'):
+                use_copy_file_range = False
+                continue
+            break
+        if n == 0:
+            break
+        copied += n
+    return copied
+
+def clamp_to_input(input_size, offset, size):
+    """Number of bytes actually available at offset (matches a short read at EOF)"""
+    return max(0, min(size, input_size - offset))
+
+def copy_tensor_data(f, mm, shard_f, offset, size):
+    """Append size bytes of the input starting at offset to shard_f, returns bytes copied"""
+    # Never copy past the end of the input
+    size = clamp_to_input(len(mm), offset, size)
     
-    element_size = type_sizes.get(tensor_type, 4)
-    total_elements = 1
-    for dim in dims:
-        total_elements *= dim
+    # Flush buffered header bytes so the kernel copy lands after them
+    shard_f.flush()
+    copied = 0
+    if hasattr(os, 'copy_file_range') or hasattr(os, 'sendfile'):
+        copied = _kernel_copy(f.fileno(), shard_f.fileno(), offset, size)
     
-    return total_elements * element_size
+    # Finish whatever the kernel did not copy through the mapping
+    while copied < size:
+        count = min(COPY_CHUNK_SIZE, size - copied)
+        with memoryview(mm)[offset + copied:offset + copied + count] as chunk:
+            shard_f.write(chunk)
+        copied += count
+    return size
 
-def split_gguf(input_file, num_shards, output_dir):
-    """Split GGUF file into shards respecting tensor boundaries"""
+@lru_cache(maxsize=None)
+def _tensor_info_struct(name_len, n_dims):
+    """Struct for one tensor info record; names and dim counts repeat a lot"""
+    return struct.Struct(f'<Q{name_len}sI{n_dims}QIQ')
+
+def pack_tensor_info(name, dims, tensor_type, data_offset):
+    """Serialize a tensor info record (name, dims, type, data offset) in one pack"""
+    name_bytes = name.encode('utf-8')
+    return _tensor_info_struct(len(name_bytes), len(dims)).pack(
+        len(name_bytes), name_bytes, len(dims), *dims, tensor_type, data_offset)
+
+def partition_tensors(tensors, num_shards):
+    """Split tensor indices into num_shards contiguous runs of near-equal total bytes"""
+    sizes = tensors['sizes']
+    num_tensors = len(sizes)
     
-    print(f"\nGGUF Proper Splitter")
-    print(f"Input: {input_file}")
-    print(f"Shards: {num_shards}")
-    print(f"Output: {output_dir}\n")
+    # Nodes expect shard N to hold a contiguous layer range, so declaration
+    # order is kept and only the cut points move. Each cut lands on the prefix
+    # sum closest to k/num_shards of the total: tensor sizes span orders of
+    # magnitude (embeddings vs norms), so equal counts give very uneven shards.
+    prefix = list(accumulate(sizes, initial=0))
+    total = prefix[-1]
+    cuts = [0]
+    for k in range(1, num_shards):
+        target = total * k / num_shards
+        cut = bisect_left(prefix, target)
+        if cut > 0 and (cut > num_tensors or target - prefix[cut - 1] <= prefix[cut] - target):
+            cut -= 1
+        # Leave at least one tensor for this shard and each one after it
+        spare = 1 if num_tensors >= num_shards else 0
+        cut = max(cut, cuts[-1] + spare)
+        cut = min(cut, num_tensors - spare * (num_shards - k))
+        cuts.append(cut)
+    cuts.append(num_tensors)
+    return [list(range(start, end)) for start, end in zip(cuts, cuts[1:])]
+
+def shard_input_range(tensors, shard_indices):
+    """(start, length) of the input span holding a shard's tensor data"""
+    offsets = tensors['offsets']
+    sizes = tensors['sizes']
+    start = min(offsets[i] for i in shard_indices)
+    end = max(offsets[i] + sizes[i] for i in shard_indices)
+    return start, end - start
+
+def advise_willneed(f, tensors, shard_indices):
+    """Ask the kernel to start reading the input range a shard will copy"""
+    if not shard_indices or not hasattr(os, 'posix_fadvise'):
+        return
+    start, length = shard_input_range(tensors, shard_indices)
+    os.posix_fadvise(f.fileno(), start, length, os.POSIX_FADV_WILLNEED)
+
+def advise_dontneed(f, tensors, shard_indices):
+    """Drop a shard's input range from the page cache once it has been copied"""
+    # Each input byte is copied exactly once, so keeping it cached would only
+    # evict weights that other shards still need
+    if not shard_indices or not hasattr(os, 'posix_fadvise'):
+        return
+    start, length = shard_input_range(tensors, shard_indices)
+    os.posix_fadvise(f.fileno(), start, length, os.POSIX_FADV_DONTNEED)
+
+def preallocate(fd, total_size):
+    """Reserve the shard's full size up front so it lands in contiguous extents"""
+    if total_size <= 0 or not hasattr(os, 'posix_fallocate'):
+        return
+    try:
+        os.posix_fallocate(fd, 0, total_size)
+    except OSError:
+        # Not supported by this filesystem; the file just grows as it is written
+        pass
+
+def _pwrite_all(fd, data, offset):
+    """pwrite all of data at offset, retrying short writes"""
+    written = 0
+    while written < len(data):
+        written += os.pwrite(fd, data[written:], offset + written)
+
+def _shard_pieces(mm, header, layout):
+    """Yield the shard's bytes in order: header, then each tensor's record and data"""
+    yield header
+    with memoryview(mm) as src:
+        for record, offset, size in layout:
+            yield record
+            for start in range(offset, offset + size, COPY_CHUNK_SIZE):
+                yield src[start:min(start + COPY_CHUNK_SIZE, offset + size)]
+
+def write_shard_direct(f, mm, shard_path, header, layout, shard_size):
+    """Write a shard with O_DIRECT through an aligned bounce buffer, returns False if unsupported"""
+    if not hasattr(os, 'O_DIRECT'):
+        return False
+    try:
+        fd = os.open(shard_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_DIRECT, 0o644)
+    except OSError as e:
+        if e.errno == errno.EINVAL:
+            # Filesystem does not support O_DIRECT
+            return False
+        raise
+    pieces = _shard_pieces(mm, header, layout)
+    try:
+        preallocate(fd, shard_size)
+        # Anonymous mappings are page aligned, as O_DIRECT requires
+        with mmap.mmap(-1, DIRECT_IO_BUFFER_SIZE) as bounce, memoryview(bounce) as buf:
+            # Errors are handled inside this block so no traceback still holds
+            # slices of the buffers when they are closed
+            try:
+                filled = 0
+                file_offset = 0
+                for piece in pieces:
+                    pos = 0
+                    while pos < len(piece):
+                        count = min(len(piece) - pos, DIRECT_IO_BUFFER_SIZE - filled)
+                        buf[filled:filled + count] = piece[pos:pos + count]
+                        filled += count
+                        pos += count
+                        if filled == DIRECT_IO_BUFFER_SIZE:
+                            _pwrite_all(fd, buf, file_offset)
+                            file_offset += filled
+                            filled = 0
+                if filled:
+                    # The tail must be written as whole aligned blocks; the
+                    # zero padding is cut off again by the truncate below
+                    padded = -(-filled // DIRECT_IO_ALIGNMENT) * DIRECT_IO_ALIGNMENT
+                    buf[filled:padded] = bytes(padded - filled)
+                    _pwrite_all(fd, buf[:padded], file_offset)
+                os.ftruncate(fd, shard_size)
+            except OSError as e:
+                # O_DIRECT accepted at open but refused on write (EINVAL), or
+                # a real I/O error; the caller rewrites the shard through the
+                # page cache, which reports real errors the usual way
+                print(f"  Direct write of {os.path.basename(shard_path)} failed ({e}), using buffered writes")
+                return False
+    finally:
+        pieces.close()
+        os.close(fd)
+    return True
+
+def write_shard(f, mm, shard_path, version, data_start, tensors, shard_indices):
+    """Write one shard file holding the tensors at shard_indices copied out of the input f (mapped as mm)"""
+    # All workers share the input handle and its mapping: every copy passes an
+    # explicit source offset, so the shared file position is never used
     
-    os.makedirs(output_dir, exist_ok=True)
+    # Write GGUF header: magic, version, num_kv, tensor count.
+    # For simplicity, we write minimal metadata (num_kv = 0 for now);
+    # in production, you'd copy the relevant metadata from the original
+    header = GGUF_MAGIC + struct.pack('<IQQ', version, 0, len(shard_indices))
     
-    with open(input_file, 'rb') as f:
-        # Read magic and version
-        magic = f.read(4)
-        if magic != GGUF_MAGIC:
-            print(f"Error: Not a valid GGUF file (magic: {magic})")
-            return False
-        
-        version = struct.unpack('<I', f.read(4))[0]
-        print(f"GGUF version: {version}")
-        
-        # Read general metadata count
-        general_metadata_count = struct.unpack('<Q', f.read(8))[0]
-        print(f"General metadata count: {general_metadata_count}")
-        
-        # Read tensor metadata count (GGUF v3 has separate tensor metadata)
-        tensor_metadata_count = struct.unpack('<Q', f.read(8))[0]
-        print(f"Tensor metadata count: {tensor_metadata_count}")
-        
+    # Lay out tensor info records first so the exact shard size is known
+    names, dims, types = tensors['names'], tensors['dims'], tensors['types']
+    offsets, sizes = tensors['offsets'], tensors['sizes']
+    layout = []
+    shard_size = len(header)
+    shard_data_offset = data_start
+    for i in shard_indices:
+        size = clamp_to_input(len(mm), offsets[i], sizes[i])
+        record = pack_tensor_info(names[i], dims[i], types[i], shard_data_offset)
+        layout.append((record, offsets[i], size))
+        shard_data_offset += size
+        shard_size += len(record) + size
+    
+    advise_willneed(f, tensors, shard_indices)
+    if not (shard_size >= DIRECT_IO_MIN_SHARD_SIZE and
+            write_shard_direct(f, mm, shard_path, header, layout, shard_size)):
+        with open(shard_path, 'wb') as shard_f:
+            preallocate(shard_f.fileno(), shard_size)
+            shard_f.write(header)
+            
+            # Write tensor info and copy tensor data
+            for record, offset, size in layout:
+                shard_f.write(record)
+                copy_tensor_data(f, mm, shard_f, offset, size)
+    
+    advise_dontneed(f, tensors, shard_indices)
+    return shard_path
+
+def read_header(f, mm):
+    """Parse the GGUF header of f (mapped as mm), returns (version, data_start, tensors) or None if f is not GGUF"""
+    # Read magic and version
+    magic = f.read(4)
+    if magic != GGUF_MAGIC:
+        print(f"Error: Not a valid GGUF file (magic: {magic})")
+        return None
+    
+    version = _U32.unpack(f.read(4))[0]
+    print(f"GGUF version: {version}")
+    
+    # Read general metadata count
+    general_metadata_count = _U64.unpack(f.read(8))[0]
+    print(f"General metadata count: {general_metadata_count}")
+    
+    # Read tensor metadata count (GGUF v3 has separate tensor metadata)
+    tensor_metadata_count = _U64.unpack(f.read(8))[0]
+    print(f"Tensor metadata count: {tensor_metadata_count}")
+    
+    if _gguf_parse is not None:
+        # Compiled scan over the mapping; metadata values are only counted
+        print("Scanning metadata with compiled parser...")
+        found, tensor_infos, end = _gguf_parse.scan_header(
+            mm, f.tell(), general_metadata_count, tensor_metadata_count)
+        f.seek(end)
+        num_tensors = len(tensor_infos)
+        print(f"Found {found} general metadata entries")
+        print(f"Found {num_tensors} tensors")
+    else:
         # Read general metadata
         print("Reading general metadata...")
         metadata = {}
@@ -165,43 +506,36 @@ def split_gguf(input_file, num_shards, output_dir):
             if i % 50 == 0:
                 print(f"  Reading metadata entry {i}/{general_metadata_count} (position: {f.tell()})")
             key = read_string(f)
-            value_type = struct.unpack('<I', f.read(4))[0]
-            
+            value_type = _U32.unpack(f.read(4))[0]
+        
             if value_type == 8:  # STRING
-                value = read_string(f)
+                # Only the shape of the metadata is used here, so large values
+                # (e.g. tokenizer vocabularies) are recorded but not decoded
+                length = skip_string(f)
+                value = LazyValue(f, f.tell() - length, length, value_type)
             elif value_type == 0:  # UINT8
-                value = struct.unpack('<B', f.read(1))[0]
+                value = _U8.unpack(f.read(1))[0]
             elif value_type == 1:  # INT8
-                value = struct.unpack('<b', f.read(1))[0]
+                value = _I8.unpack(f.read(1))[0]
             elif value_type == 2:  # UINT16
-                value = struct.unpack('<H', f.read(2))[0]
+                value = _U16.unpack(f.read(2))[0]
             elif value_type == 3:  # INT16
-                value = struct.unpack('<h', f.read(2))[0]
+                value = _I16.unpack(f.read(2))[0]
             elif value_type == 4:  # UINT32
-                value = struct.unpack('<I', f.read(4))[0]
+                value = _U32.unpack(f.read(4))[0]
             elif value_type == 5:  # INT32
-                value = struct.unpack('<i', f.read(4))[0]
+                value = _I32.unpack(f.read(4))[0]
             elif value_type == 6:  # FLOAT32
-                value = struct.unpack('<f', f.read(4))[0]
+                value = _F32.unpack(f.read(4))[0]
             elif value_type == 7:  # BOOL
-                value = struct.unpack('<?', f.read(1))[0]
+                value = _BOOL.unpack(f.read(1))[0]
             elif value_type == 9:  # ARRAY
-                array_type = struct.unpack('<I', f.read(4))[0]
-                array_len = struct.unpack('<Q', f.read(8))[0]
+                array_type = _U32.unpack(f.read(4))[0]
+                array_len = _U64.unpack(f.read(8))[0]
                 if array_len > 1000000:
                     raise ValueError(f"Array length too large: {array_len}")
-                value = []
-                for _ in range(array_len):
-                    if array_type == 8:  # STRING
-                        value.append(read_string(f))
-                    elif array_type == 4:  # UINT32
-                        value.append(struct.unpack('<I', f.read(4))[0])
-                    elif array_type == 5:  # INT32
-                        value.append(struct.unpack('<i', f.read(4))[0])
-                    elif array_type == 6:  # FLOAT32
-                        value.append(struct.unpack('<f', f.read(4))[0])
-                    else:
-                        f.read(4)  # Skip unknown array types
+                value = LazyValue(f, f.tell(), array_len, value_type, array_type)
+                skip_array(f, array_type, array_len)
             else:
                 # Skip unknown types - try to skip 4 bytes as a guess
                 try:
@@ -209,120 +543,175 @@ def split_gguf(input_file, num_shards, output_dir):
                 except:
                     pass
                 continue  # Don't add to metadata
-                
+            
             metadata[key] = value
-        
+    
         print(f"Found {len(metadata)} general metadata entries")
-        
+    
         # Skip tensor metadata (we don't need it for splitting)
         print(f"Skipping {tensor_metadata_count} tensor metadata entries...")
         for _ in range(tensor_metadata_count):
-            _ = read_string(f)  # key
-            value_type = struct.unpack('<I', f.read(4))[0]
+            skip_string(f)  # key
+            value_type = _U32.unpack(f.read(4))[0]
             if value_type == 8:  # STRING
-                _ = read_string(f)
-            elif value_type in (0, 1, 7):  # UINT8, INT8, BOOL
-                f.read(1)
-            elif value_type in (2, 3):  # UINT16, INT16
-                f.read(2)
-            elif value_type in (4, 5, 6):  # UINT32, INT32, FLOAT32
-                f.read(4)
+                skip_string(f)
             elif value_type == 9:  # ARRAY
-                array_type = struct.unpack('<I', f.read(4))[0]
-                array_len = struct.unpack('<Q', f.read(8))[0]
-                for _ in range(array_len):
-                    if array_type == 8:
-                        _ = read_string(f)
-                    elif array_type in (4, 5, 6):
-                        f.read(4)
-                    else:
-                        f.read(4)
-        
+                array_type = _U32.unpack(f.read(4))[0]
+                array_len = _U64.unpack(f.read(8))[0]
+                skip_array(f, array_type, array_len)
+            elif value_type in _VALUE_TYPE_SIZES:
+                f.seek(_VALUE_TYPE_SIZES[value_type], 1)
+    
         # Read tensor count
-        num_tensors = struct.unpack('<Q', f.read(8))[0]
+        num_tensors = _U64.unpack(f.read(8))[0]
+        tensor_infos = (read_tensor_info(f) for _ in range(num_tensors))
         print(f"Found {num_tensors} tensors")
+    
+    
+    # Read all tensor info into a column-wise table
+    tensors = new_tensor_table(num_tensors)
+    names, dims, types = tensors['names'], tensors['dims'], tensors['types']
+    offsets, sizes = tensors['offsets'], tensors['sizes']
+    for i, info in enumerate(tensor_infos):
+        names[i], dims[i], types[i], offsets[i] = info
+    fill_tensor_sizes(tensors)
+    for i in range(min(num_tensors, 5)):  # Show first 5
+        print(f"  Tensor {i}: {names[i]} at offset {offsets[i]} ({sizes[i]} bytes)")
+    
+    if num_tensors > 5:
+        print(f"  ... and {num_tensors - 5} more tensors")
+    
+    # Get file size
+    f.seek(0, 2)  # Seek to end
+    file_size = f.tell()
+    
+    # Calculate tensor data start (current position after reading all tensor info)
+    data_start = f.tell()
+    
+    print(f"\nTensor data starts at offset: {data_start}")
+    print(f"Total file size: {file_size} bytes ({file_size / (1024**3):.2f} GB)")
+    
+    return version, data_start, tensors
+
+def tensor_index_path(input_file):
+    """Sidecar file caching the parsed header of input_file"""
+    return f"{input_file}.index.mp"
+
+def load_tensor_index(input_file):
+    """Return (version, data_start, tensors) from a fresh sidecar, or None to rescan"""
+    index_path = tensor_index_path(input_file)
+    if msgpack is None or not os.path.exists(index_path):
+        return None
+    # A sidecar older than the model may describe a different file
+    input_stat = os.stat(input_file)
+    if os.path.getmtime(index_path) <= input_stat.st_mtime:
+        return None
+    try:
+        with open(index_path, 'rb') as index_f:
+            index = msgpack.unpack(index_f, raw=False)
+        if index['format'] != TENSOR_INDEX_FORMAT or index['input_size'] != input_stat.st_size:
+            return None
+        tensors = {
+            'names': index['names'],
+            'dims': index['dims'],
+            'types': array('I', index['types']),
+            'offsets': array('Q', index['offsets']),
+            'sizes': array('Q', bytes(8 * len(index['names']))),
+        }
+    except (OSError, ValueError, KeyError, TypeError, msgpack.UnpackException):
+        # Corrupt or foreign sidecar; fall back to parsing the header
+        return None
+    # Sizes are derived from the type table, which may have changed since the
+    # index was written, so they are always recomputed
+    fill_tensor_sizes(tensors)
+    print(f"Loaded {len(tensors['names'])} tensors from index {index_path}")
+    return index['version'], index['data_start'], tensors
+
+def save_tensor_index(input_file, version, data_start, tensors):
+    """Write the parsed header next to input_file so later runs can skip the scan"""
+    if msgpack is None:
+        return
+    index_path = tensor_index_path(input_file)
+    index = {
+        'format': TENSOR_INDEX_FORMAT,
+        'input_size': os.path.getsize(input_file),
+        'version': version,
+        'data_start': data_start,
+        'names': tensors['names'],
+        'dims': tensors['dims'],
+        # Numeric columns are stored as their raw native-endian bytes
+        'types': tensors['types'].tobytes(),
+        'offsets': tensors['offsets'].tobytes(),
+    }
+    tmp_path = f"{index_path}.tmp"
+    try:
+        with open(tmp_path, 'wb') as index_f:
+            msgpack.pack(index, index_f, use_bin_type=True)
+        os.replace(tmp_path, index_path)
+    except OSError as e:
+        # The index is only a cache, e.g. the model directory may be read-only
+        print(f"Warning: could not write tensor index {index_path}: {e}")
+
+def split_gguf(input_file, num_shards, output_dir):
+    """Split GGUF file into shards respecting tensor boundaries"""
+    
+    print(f"\nGGUF Proper Splitter")
+    print(f"Input: {input_file}")
+    print(f"Shards: {num_shards}")
+    print(f"Output: {output_dir}\n")
+    
+    os.makedirs(output_dir, exist_ok=True)
+    
+    # An empty file cannot be mapped; report it like any other bad magic
+    if os.path.getsize(input_file) == 0:
+        print(f"Error: Not a valid GGUF file (magic: {b''})")
+        return False
+    
+    # Tensor data is written straight out of a read-only mapping of the input,
+    # so no Python buffer of tensor size is ever materialized
+    with open(input_file, 'rb', buffering=HEADER_READ_BUFFER_SIZE) as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        advise_sequential(f, mm)
         
-        # Read all tensor info
-        tensors = []
-        for i in range(num_tensors):
-            tensor_info = read_tensor_info(f)
-            tensor_info['size'] = get_tensor_size(tensor_info['dims'], tensor_info['type'])
-            tensors.append(tensor_info)
-            if i < 5:  # Show first 5
-                print(f"  Tensor {i}: {tensor_info['name']} at offset {tensor_info['offset']} ({tensor_info['size']} bytes)")
-        
-        if num_tensors > 5:
-            print(f"  ... and {num_tensors - 5} more tensors")
-        
-        # Get file size
-        f.seek(0, 2)  # Seek to end
-        file_size = f.tell()
-        
-        # Calculate tensor data start (current position after reading all tensor info)
-        data_start = f.tell()
-        
-        print(f"\nTensor data starts at offset: {data_start}")
-        print(f"Total file size: {file_size} bytes ({file_size / (1024**3):.2f} GB)")
+        header = load_tensor_index(input_file)
+        if header is None:
+            header = read_header(f, mm)
+            if header is None:
+                return False
+            save_tensor_index(input_file, *header)
+        version, data_start, tensors = header
+        num_tensors = len(tensors['names'])
+        sizes = tensors['sizes']
         
         # Strategy: Split tensors across shards
         # Each shard gets a subset of tensors
-        tensors_per_shard = num_tensors // num_shards
-        remainder = num_tensors % num_shards
+        shards = partition_tensors(tensors, num_shards)
         
-        print(f"\nSplitting {num_tensors} tensors across {num_shards} shards...")
-        print(f"Tensors per shard: ~{tensors_per_shard} (with {remainder} extra tensors)\n")
+        print(f"\nSplitting {num_tensors} tensors across {num_shards} shards (balanced by size)...")
+        for shard_num, shard_indices in enumerate(shards):
+            shard_bytes = sum(sizes[i] for i in shard_indices)
+            print(f"  Shard {shard_num}: {len(shard_indices)} tensors, {shard_bytes / (1024**2):.2f} MB")
+        print()
         
-        # Create shard files
-        tensor_idx = 0
-        for shard_num in range(num_shards):
-            shard_path = os.path.join(output_dir, f"shard-{shard_num}.gguf")
-            print(f"Creating shard {shard_num + 1}/{num_shards}: {os.path.basename(shard_path)}")
-            
-            with open(shard_path, 'wb') as shard_f:
-                # Write GGUF header
-                shard_f.write(GGUF_MAGIC)
-                shard_f.write(struct.pack('<I', version))
-                
-                # Write metadata (copy from original)
-                # For simplicity, we'll write a minimal metadata
-                # In production, you'd copy the relevant metadata
-                shard_f.write(struct.pack('<Q', 0))  # num_kv = 0 for now
-                
-                # Calculate how many tensors this shard gets
-                shard_tensor_count = tensors_per_shard + (1 if shard_num < remainder else 0)
-                
-                # Write tensor count
-                shard_f.write(struct.pack('<Q', shard_tensor_count))
-                
-                # Write tensor info and copy tensor data
-                shard_data_offset = data_start
-                for i in range(shard_tensor_count):
-                    if tensor_idx >= num_tensors:
-                        break
-                    
-                    tensor = tensors[tensor_idx]
-                    
-                    # Write tensor info
-                    name_bytes = tensor['name'].encode('utf-8')
-                    shard_f.write(struct.pack('<Q', len(name_bytes)))
-                    shard_f.write(name_bytes)
-                    shard_f.write(struct.pack('<I', len(tensor['dims'])))
-                    for dim in tensor['dims']:
-                        shard_f.write(struct.pack('<Q', dim))
-                    shard_f.write(struct.pack('<I', tensor['type']))
-                    shard_f.write(struct.pack('<Q', shard_data_offset))
-                    
-                    # Copy tensor data
-                    f.seek(tensor['offset'])
-                    tensor_data = f.read(tensor['size'])
-                    shard_f.write(tensor_data)
-                    shard_data_offset += len(tensor_data)
-                    
-                    tensor_idx += 1
-            
-            shard_size = os.path.getsize(shard_path)
-            print(f"  Complete! ({shard_size / (1024**2):.2f} MB)\n")
+        # Create shard files. Shards read disjoint byte ranges of the one open
+        # input and mapping and write independent files, and the GIL is
+        # released during the copy syscalls, so plain threads run them in
+        # parallel. Each shard copies one contiguous run of tensors, so the
+        # mapping keeps its sequential access hint.
+        workers = min(num_shards, os.cpu_count() or 1)
+        print(f"Writing {num_shards} shards with {workers} worker threads...")
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [
+                pool.submit(write_shard, f, mm,
+                            os.path.join(output_dir, f"shard-{shard_num}.gguf"),
+                            version, data_start, tensors, shard_indices)
+                for shard_num, shard_indices in enumerate(shards)
+            ]
+            for shard_num, future in enumerate(futures):
+                shard_path = future.result()
+                shard_size = os.path.getsize(shard_path)
+                print(f"  Created shard {shard_num + 1}/{num_shards}: {os.path.basename(shard_path)} ({shard_size / (1024**2):.2f} MB)")
     
+    print()
     print("Shard splitting complete!")
     return True
 
@@ -12,7 +12,8 @@ use std::collections::HashMap;
 use tokio::sync::{RwLock, Mutex, oneshot};
 use tokio::net::{TcpListener, TcpStream};
 use tokio::time::{Duration, Instant};
-use tokio_tungstenite::{accept_async, tungstenite::Message};
+use tokio_tungstenite::{accept_hdr_async, tungstenite::Message};
+use tokio_tungstenite::tungstenite::handshake::server::{Request as HandshakeRequest, Response as HandshakeResponse, ErrorResponse};
 use futures_util::{StreamExt, SinkExt};
 use serde::{Deserialize, Serialize};
 use punch_simple::pipeline_coordinator::{PipelineCoordinator, InferenceRequest, PipelineStrategy, NodeSpawner};
@@ -34,6 +35,9 @@ use libp2p::{
 };
 use libp2p::swarm::Config as SwarmConfig;
 
+/// Content-Type a client sends on the WebSocket upgrade to exchange queries as msgpack binary frames
+const MSGPACK_CONTENT_TYPE: &str = "application/msgpack";
+
 /// Query request from web client
 #[derive(Deserialize)]
 struct QueryRequest {
@@ -1737,9 +1741,15 @@ async fn handle_connection(
 ) {
     println!("[WS] New TCP connection from: {}", addr);
     
-    let ws_stream = match accept_async(stream).await {
+    // Clients opt into msgpack query/response frames with a Content-Type header
+    let mut msgpack = false;
+    let check_content_type = |request: &HandshakeRequest, response: HandshakeResponse| -> Result<HandshakeResponse, ErrorResponse> {
+        msgpack = wants_msgpack(request);
+        Ok(response)
+    };
+    let ws_stream = match accept_hdr_async(stream, check_content_type).await {
         Ok(ws) => {
-            println!("[WS] ✓ WebSocket upgrade successful from: {}", addr);
+            println!("[WS] ✓ WebSocket upgrade successful from: {} (msgpack: {})", addr, msgpack);
             ws
         }
         Err(e) => {
@@ -1993,31 +2003,21 @@ async fn handle_connection(
                             Err(_) => QueryRequest { query: text, request_id: None },
                         };
                         
-                        // Process query
-                        println!("[WS] Processing query: {}", request.query);
-                        let mut response = engine.process_query(&request.query, Some(&update_tx)).await;
-                        response.request_id = request.request_id;
-                        println!("[WS] Query processed, sending response");
+                        handle_query(&engine, request, &update_tx, &outgoing_tx, false).await;
+                    }
+                    Some(Ok(Message::Binary(data))) if msgpack => {
+                        println!("[WS] Received msgpack query ({} bytes)", data.len());
                         
-                        // Send final response
-                        let response_json = serde_json::to_string(&response).unwrap();
-                        let _ = outgoing_tx.send(Message::Text(response_json));
+                        // Binary frames only carry query requests
+                        let request: QueryRequest = match rmp_serde::from_slice(&data) {
+                            Ok(r) => r,
+                            Err(e) => {
+                                eprintln!("[WS] Failed to decode msgpack query from {}: {}", addr, e);
+                                continue;
+                            }
+                        };
                         
-                        // Send updated pipeline status after query
-                        {
-                            let (online_nodes, total_nodes, missing_shards, is_complete) = engine.coordinator.get_pipeline_status().await;
-                            
-                            let status_msg = PipelineStatusMessage {
-                                message_type: "pipeline_status".to_string(),
-                                total_nodes,
-                                online_nodes,
-                                missing_shards,
-                                is_complete,
-                            };
-                            
-                            let status_json = serde_json::to_string(&status_msg).unwrap();
-                            let _ = outgoing_tx.send(Message::Text(status_json));
-                        }
+                        handle_query(&engine, request, &update_tx, &outgoing_tx, true).await;
                     }
                     Some(Ok(Message::Close(_))) => {
                         println!("[WS] Client {} disconnected", addr);
@@ -2104,6 +2104,52 @@ async fn handle_connection(
     }
 }
 
+/// Whether the WebSocket upgrade request asks for msgpack query/response frames
+fn wants_msgpack(request: &HandshakeRequest) -> bool {
+    request.headers()
+        .get("content-type")
+        .and_then(|v| v.to_str().ok())
+        .map_or(false, |v| v.eq_ignore_ascii_case(MSGPACK_CONTENT_TYPE))
+}
+
+/// Process a query and send the response, followed by the updated pipeline status
+/// The response is msgpack in a binary frame for msgpack clients; status stays JSON text
+async fn handle_query(
+    engine: &Arc<InferenceEngine>,
+    request: QueryRequest,
+    update_tx: &tokio::sync::mpsc::Sender<PipelineUpdate>,
+    outgoing_tx: &tokio::sync::mpsc::UnboundedSender<Message>,
+    msgpack: bool,
+) {
+    // Process query
+    println!("[WS] Processing query: {}", request.query);
+    let mut response = engine.process_query(&request.query, Some(update_tx)).await;
+    response.request_id = request.request_id;
+    println!("[WS] Query processed, sending response");
+    
+    // Send final response
+    let response_msg = if msgpack {
+        Message::Binary(rmp_serde::to_vec_named(&response).unwrap())
+    } else {
+        Message::Text(serde_json::to_string(&response).unwrap())
+    };
+    let _ = outgoing_tx.send(response_msg);
+    
+    // Send updated pipeline status after query
+    let (online_nodes, total_nodes, missing_shards, is_complete) = engine.coordinator.get_pipeline_status().await;
+    
+    let status_msg = PipelineStatusMessage {
+        message_type: "pipeline_status".to_string(),
+        total_nodes,
+        online_nodes,
+        missing_shards,
+        is_complete,
+    };
+    
+    let status_json = serde_json::to_string(&status_msg).unwrap();
+    let _ = outgoing_tx.send(Message::Text(status_json));
+}
+
 /// Calculate XOR distance between two peer IDs (Kademlia distance metric)
 /// Returns the XOR result as u64 for distance comparison
 /// Uses Kademlia's queue ordering: closer nodes queried first
@@ -2350,3 +2396,53 @@ mod work_stealing_deterministic_unit_tests {
     }
 }
 
+#[cfg(test)]
+mod msgpack_frame_unit_tests {
+    use super::{wants_msgpack, HandshakeRequest, QueryRequest, QueryResponse, ShardInfo, MSGPACK_CONTENT_TYPE};
+
+    #[test]
+    fn content_type_header_selects_msgpack() {
+        let request = HandshakeRequest::builder()
+            .header("Content-Type", "Application/MsgPack")
+            .body(())
+            .unwrap();
+        assert!(wants_msgpack(&request));
+
+        let request = HandshakeRequest::builder().body(()).unwrap();
+        assert!(!wants_msgpack(&request), "JSON stays the default without the header");
+
+        let request = HandshakeRequest::builder()
+            .header("Content-Type", "application/json")
+            .body(())
+            .unwrap();
+        assert!(!wants_msgpack(&request));
+        assert_eq!(MSGPACK_CONTENT_TYPE, "application/msgpack");
+    }
+
+    #[test]
+    fn decodes_query_packed_by_python_client() {
+        // msgpack.packb({"query": ..., "request_id": ...}, use_bin_type=True) from test_inference.py
+        let frame = b"\x82\xa5query\xb3what does a cow say\xaarequest_id\xafcow-query-12345";
+        let request: QueryRequest = rmp_serde::from_slice(frame).unwrap();
+        assert_eq!(request.query, "what does a cow say");
+        assert_eq!(request.request_id.as_deref(), Some("cow-query-12345"));
+    }
+
+    #[test]
+    fn response_encodes_as_map_with_field_names() {
+        let response = QueryResponse {
+            response: "Moo".to_string(),
+            tokens: 1,
+            latency_ms: 2,
+            shards_used: vec![ShardInfo { shard_id: 0, layer_start: 0, layer_end: 7, latency_ms: 2 }],
+            success: true,
+            request_id: Some("cow-query-12345".to_string()),
+        };
+        // The client looks fields up by name, so the response must be a map, not an array
+        let frame = rmp_serde::to_vec_named(&response).unwrap();
+        let decoded: serde_json::Value = rmp_serde::from_slice(&frame).unwrap();
+        assert_eq!(decoded["response"], "Moo");
+        assert_eq!(decoded["request_id"], "cow-query-12345");
+        assert_eq!(decoded["shards_used"][0]["layer_end"], 7);
+    }
+}
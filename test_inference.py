@@ -5,8 +5,53 @@ import websockets
 import json
 import sys
 
-async def test_inference():
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Queries are JSON text frames by default; msgpack binary frames are opt-in
+# (--msgpack) and advertised with a Content-Type header on the upgrade. The
+# server then answers the query in a binary frame, status updates stay JSON.
+MSGPACK_CONTENT_TYPE = "application/msgpack"
+
+# websockets 14 renamed the connect() keyword for extra handshake headers
+HEADERS_KWARG = (
+    "additional_headers"
+    if int(websockets.__version__.split(".")[0]) >= 14
+    else "extra_headers"
+)
+
+def encode_request(obj, use_msgpack):
+    if use_msgpack:
+        return msgpack.packb(obj, use_bin_type=True)
+    return json.dumps(obj)
+
+def decode_response(frame):
+    # Binary frames carry msgpack, text frames carry JSON
+    if isinstance(frame, bytes):
+        return msgpack.unpackb(frame, raw=False)
+    return json.loads(frame)
+
+async def recv_response(websocket, request_id):
+    """Return (frame, decoded) for our query's response, skipping status and pipeline updates"""
+    while True:
+        frame = await websocket.recv()
+        try:
+            obj = decode_response(frame)
+        except Exception:
+            continue
+        if isinstance(obj, dict) and obj.get("request_id") == request_id and "response" in obj:
+            return frame, obj
+
+async def test_inference(use_msgpack=False):
     uri = "ws://localhost:8081"
+    connect_kwargs = {}
+    if use_msgpack:
+        if msgpack is None:
+            print("❌ --msgpack requires the msgpack package (pip install msgpack)")
+            return 1
+        connect_kwargs[HEADERS_KWARG] = {"Content-Type": MSGPACK_CONTENT_TYPE}
     
     print("\n=== TESTING INFERENCE REQUEST ===")
     print("Question: what does a cow say")
@@ -14,7 +59,7 @@ async def test_inference():
     
     try:
         print("[1/4] Connecting to WebSocket server...")
-        async with websockets.connect(uri) as websocket:
+        async with websockets.connect(uri, **connect_kwargs) as websocket:
             print("  ✓ Connected to WebSocket")
             
             # Create query request
@@ -25,31 +70,26 @@ async def test_inference():
             
             print("\n[2/4] Sending inference request...")
             print(f"  Request: {json.dumps(query_request)}")
+            if use_msgpack:
+                print(f"  Encoding: {MSGPACK_CONTENT_TYPE} (binary frame)")
             
-            await websocket.send(json.dumps(query_request))
+            await websocket.send(encode_request(query_request, use_msgpack))
             print("  ✓ Request sent")
             
             print("\n[3/4] Waiting for response...")
             
             # Wait for response with timeout
             try:
-                response_text = await asyncio.wait_for(websocket.recv(), timeout=120.0)
+                response_frame, response_obj = await asyncio.wait_for(
+                    recv_response(websocket, query_request["request_id"]), timeout=120.0)
                 
                 print("\n[4/4] Response received!")
+                if use_msgpack and not isinstance(response_frame, bytes):
+                    print("  ⚠ Server answered with JSON text, not msgpack")
                 print("\n" + "=" * 70)
                 print("AI RESPONSE:")
                 print("=" * 70)
-                
-                # Parse and display response
-                try:
-                    response_obj = json.loads(response_text)
-                    if "response" in response_obj:
-                        print(response_obj["response"])
-                    else:
-                        print(response_text)
-                except:
-                    print(response_text)
-                
+                print(response_obj["response"])
                 print("=" * 70)
                 print()
                 print("✓ Test completed successfully!")
@@ -68,7 +108,7 @@ async def test_inference():
 
 if __name__ == "__main__":
     try:
-        exit_code = asyncio.run(test_inference())
+        exit_code = asyncio.run(test_inference(use_msgpack="--msgpack" in sys.argv[1:]))
         sys.exit(exit_code)
     except KeyboardInterrupt:
         print("\n\nInterrupted by user")